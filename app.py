@@ -1,13 +1,17 @@
-from flask import Flask, request, jsonify, g
+from flask import Flask, request, g
+from flask_compress import Compress
 from train_pipeline import TrainPipeline
+import hashlib
 import logging
-from datetime import datetime
 import os
-import signal
-from functools import wraps
 import time
 import uuid
+from datetime import datetime
 import threading
+import orjson
+import ormsgpack
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as PipelineTimeout
 from werkzeug.exceptions import RequestTimeout
 
 # Set up logging
@@ -18,208 +22,310 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-pipeline = TrainPipeline()
+
+pipeline = None
+pipeline_lock = threading.Lock()
+
+def get_pipeline():
+    """Build the pipeline on first use rather than at import time, exactly once per process."""
+    global pipeline
+    if pipeline is None:
+        # Concurrent first requests wait here instead of each building their own pipeline and pools
+        with pipeline_lock:
+            if pipeline is None:
+                pipeline = TrainPipeline()
+    return pipeline
+
+# Compress larger JSON responses, preferring brotli over gzip
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_BR_LEVEL'] = 4
+app.config['COMPRESS_MIN_SIZE'] = 1024
+Compress(app)
+
+def ojsonify(data, status=200):
+    """Serialize data with orjson and wrap it in a JSON response."""
+    return app.response_class(
+        orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        mimetype='application/json'
+    )
+
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+def wants_msgpack():
+    """True when the client prefers MessagePack over JSON in its Accept header."""
+    return request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+def success_response(data):
+    """Wrap data in the success payload, as MessagePack or JSON depending on Accept."""
+    payload = {
+        'status': 'success',
+        'data': data,
+        'request_id': g.request_id
+    }
+    if wants_msgpack():
+        response = app.response_class(
+            ormsgpack.packb(payload, option=ormsgpack.OPT_SERIALIZE_NUMPY),
+            mimetype=MSGPACK_MIMETYPE
+        )
+    else:
+        response = ojsonify(payload)
+    response.vary.add('Accept')
+    return response
+
+def error_response(code, message):
+    """Build the standard error response for the current request."""
+    return ojsonify({
+        'status': 'error',
+        'code': code,
+        'message': message,
+        'request_id': g.request_id
+    }, code)
+
+def error_prefix(code, message):
+    """Pre-serialize a fixed error body up to its per-request request_id."""
+    return b'{"status":"error","code":%d,"message":%s,"request_id":' % (code, orjson.dumps(message))
+
+def static_error_response(code, prefix):
+    """Finish a pre-serialized error body with the current request ID."""
+    return app.response_class(
+        prefix + orjson.dumps(g.request_id) + b'}',
+        status=code,
+        mimetype='application/json'
+    )
+
+# The health payload never changes, so its body and ETag are built once
+HEALTH_BODY = orjson.dumps({'status': 'healthy'})
+HEALTH_ETAG = hashlib.md5(HEALTH_BODY).hexdigest()
 
 # Global timeout value in seconds
 REQUEST_TIMEOUT = 300  # 5 minutes
 
-class TimeoutError(Exception):
-    pass
-
-def timeout_handler(signum, frame):
-    raise TimeoutError("Request timed out")
-
-def timeout(seconds):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            # Set the signal handler and a timeout
-            signal.signal(signal.SIGALRM, timeout_handler)
-            signal.alarm(seconds)
-            try:
-                result = func(*args, **kwargs)
-            finally:
-                # Disable the alarm
-                signal.alarm(0)
-            return result
-        return wrapper
-    return decorator
+# Required query parameters, in the order they are reported when missing
+TRAINS_BETWEEN_FIELDS = ('source_name', 'source_code', 'destination_name', 'destination_code', 'date')
+TRAIN_SCHEDULE_FIELDS = ('train_name', 'train_number', 'date')
+
+# Validation failures have fixed messages, so their bodies are serialized once
+MISSING_FIELD_ERRORS = {
+    field: error_prefix(400, f'Missing required field: {field}')
+    for field in TRAINS_BETWEEN_FIELDS + TRAIN_SCHEDULE_FIELDS
+}
+INVALID_DATE_ERROR = error_prefix(400, 'Invalid date format, expected YYYYMMDD')
+
+def is_valid_date(date):
+    """Check a YYYYMMDD date string: fixed shape first, then a real calendar date."""
+    if len(date) != 8 or not date.isascii() or not date.isdigit():
+        return False
+    try:
+        datetime(int(date[:4]), int(date[4:6]), int(date[6:]))
+    except ValueError:
+        return False
+    return True
+
+# Worker pool for the blocking pipeline calls (scraping, training, prediction)
+PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', 8))
+executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix='pipeline')
+
+# Pipeline results are stable for a train/route on a given day, so cache them for an hour
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+schedule_cache = TTLCache(maxsize=4096, ttl=RESPONSE_CACHE_TTL)
+trains_between_cache = TTLCache(maxsize=4096, ttl=RESPONSE_CACHE_TTL)
+# Re-entrant: a pipeline call that finishes early runs store_result while cached_run holds the lock
+response_cache_lock = threading.RLock()
+
+# Optional Redis cache shared by every worker process; per-process caches still sit in front of it
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+# Seconds to wait on Redis before giving up and computing locally
+CACHE_REDIS_TIMEOUT = float(os.environ.get('CACHE_REDIS_TIMEOUT', 0.5))
+if CACHE_REDIS_URL:
+    import redis
+    shared_cache = redis.Redis.from_url(
+        CACHE_REDIS_URL,
+        socket_connect_timeout=CACHE_REDIS_TIMEOUT,
+        socket_timeout=CACHE_REDIS_TIMEOUT
+    )
+else:
+    shared_cache = None
+
+def shared_key(func, key):
+    """Redis key for a pipeline call, e.g. get_train_schedule:12303:20250521."""
+    return f"{func.__name__}:{':'.join(key)}"
+
+def shared_get(func, key):
+    """Fetch a pipeline result stored by any worker, or None."""
+    if shared_cache is None:
+        return None
+    try:
+        cached = shared_cache.get(shared_key(func, key))
+    except redis.RedisError as e:
+        logger.warning("Shared cache read failed: %s", e)
+        return None
+    return orjson.loads(cached) if cached is not None else None
+
+def shared_set(func, key, result):
+    """Publish a pipeline result to the other workers."""
+    if shared_cache is None:
+        return
+    try:
+        shared_cache.set(
+            shared_key(func, key),
+            orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY),
+            ex=RESPONSE_CACHE_TTL
+        )
+    except redis.RedisError as e:
+        logger.warning("Shared cache write failed: %s", e)
+
+# Pipeline calls still running, so identical concurrent misses share one computation
+inflight = {}
+
+# Placeholder the pipeline puts in place of a delay it could not predict
+NO_DATA = "no data found"
+
+def has_predictions(result):
+    """True if a schedule or train list carries at least one real predicted delay."""
+    if isinstance(result, dict):
+        return any(station.get('predicted_delay', NO_DATA) != NO_DATA for station in result.get('schedule', ()))
+    return any(
+        train.get(field, NO_DATA) != NO_DATA
+        for train in result
+        for field in ('source_delay', 'destination_delay')
+    )
+
+def cached_run(cache, key, func, *args):
+    """Return a cached pipeline result for key, running func on the pool on a miss."""
+    with response_cache_lock:
+        result = cache.get(key)
+    if result is not None:
+        return result
+    # Another worker may already have computed it; the lookup happens outside the lock
+    result = shared_get(func, key)
+    if result is not None:
+        with response_cache_lock:
+            cache[key] = result
+        return result
+    with response_cache_lock:
+        future = inflight.get((id(cache), key))
+        if future is None:
+            future = executor.submit(func, *args)
+            inflight[(id(cache), key)] = future
+            future.add_done_callback(lambda done: store_result(cache, key, func, done))
+    # Give up waiting after REQUEST_TIMEOUT; the call keeps running and its result is still cached
+    return future.result(timeout=REQUEST_TIMEOUT)
+
+def store_result(cache, key, func, future):
+    """Retire a finished pipeline call, caching its result if it succeeded."""
+    with response_cache_lock:
+        inflight.pop((id(cache), key), None)
+        # Only results with real predictions are cached; a failed scrape or training run
+        # comes back as all placeholders and is retried on the next request
+        result = future.result() if future.exception() is None else None
+        cacheable = bool(result) and has_predictions(result)
+        if cacheable:
+            cache[key] = result
+    if cacheable:
+        shared_set(func, key, result)
 
 @app.before_request
 def before_request():
     # Generate a unique request ID
     g.request_id = str(uuid.uuid4())
-    g.start_time = time.time()
-    logger.info(f"Request started - ID: {g.request_id}")
+    g.start_time = time.perf_counter()
+    logger.info("Request started - ID: %s", g.request_id)
 
 @app.after_request
 def after_request(response):
     # Calculate request duration
-    duration = time.time() - g.start_time
-    logger.info(f"Request completed - ID: {g.request_id} - Duration: {duration:.2f}s")
+    duration = time.perf_counter() - g.start_time
+    logger.info("Request completed - ID: %s - Duration: %.2fs", g.request_id, duration)
     return response
 
 @app.errorhandler(RequestTimeout)
+@app.errorhandler(PipelineTimeout)
 def handle_timeout(e):
-    logger.error(f"Request timed out - ID: {g.request_id}")
-    return jsonify({
-        'status': 'error',
-        'code': 504,
-        'message': 'Request timed out. Please try again.',
-        'request_id': g.request_id
-    }), 504
+    logger.error("Request timed out - ID: %s", g.request_id)
+    return error_response(504, 'Request timed out. Please try again.')
 
 @app.errorhandler(Exception)
 def handle_error(e):
-    logger.error(f"Error processing request - ID: {g.request_id}: {str(e)}")
-    return jsonify({
-        'status': 'error',
-        'code': 500,
-        'message': str(e),
-        'request_id': g.request_id
-    }), 500
+    logger.error("Error processing request - ID: %s: %s", g.request_id, e)
+    return error_response(500, str(e))
 
 @app.route('/api/trains-between', methods=['GET'])
-@timeout(REQUEST_TIMEOUT)
 def get_trains_between():
-    try:
-        # Get parameters from query string
-        source_name = request.args.get('source_name')
-        source_code = request.args.get('source_code')
-        destination_name = request.args.get('destination_name')
-        destination_code = request.args.get('destination_code')
-        date = request.args.get('date')
-        
-        # Validate required fields
-        required_fields = {
-            'source_name': source_name,
-            'source_code': source_code,
-            'destination_name': destination_name,
-            'destination_code': destination_code,
-            'date': date
-        }
+    args = request.args
+    
+    # Validate required fields
+    missing = next((field for field in TRAINS_BETWEEN_FIELDS if not args.get(field)), None)
+    if missing:
+        return static_error_response(400, MISSING_FIELD_ERRORS[missing])
+    
+    # Get parameters from query string
+    source_name = args.get('source_name')
+    source_code = args.get('source_code')
+    destination_name = args.get('destination_name')
+    destination_code = args.get('destination_code')
+    date = args.get('date')
+    
+    if not is_valid_date(date):
+        return static_error_response(400, INVALID_DATE_ERROR)
+    
+    # Get trains between stations
+    trains = cached_run(
+        trains_between_cache,
+        (source_code, destination_code, date),
+        get_pipeline().get_trains_between_stations,
+        source_name,
+        source_code,
+        destination_name,
+        destination_code,
+        date
+    )
+    
+    if not trains:
+        return error_response(404, 'No trains found between stations')
         
-        for field, value in required_fields.items():
-            if not value:
-                return jsonify({
-                    'status': 'error',
-                    'code': 400,
-                    'message': f'Missing required field: {field}',
-                    'request_id': g.request_id
-                }), 400
-        
-        # Get trains between stations
-        trains = pipeline.get_trains_between_stations(
-            source_name,
-            source_code,
-            destination_name,
-            destination_code,
-            date
-        )
-        
-        if not trains:
-            return jsonify({
-                'status': 'error',
-                'code': 404,
-                'message': 'No trains found between stations',
-                'request_id': g.request_id
-            }), 404
-            
-        return jsonify({
-            'status': 'success',
-            'data': trains,
-            'request_id': g.request_id
-        })
-        
-    except TimeoutError:
-        logger.error(f"Request timed out - ID: {g.request_id}")
-        return jsonify({
-            'status': 'error',
-            'code': 504,
-            'message': 'Request timed out. Please try again.',
-            'request_id': g.request_id
-        }), 504
-    except Exception as e:
-        logger.error(f"Error processing request - ID: {g.request_id}: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'code': 500,
-            'message': str(e),
-            'request_id': g.request_id
-        }), 500
+    return success_response(trains)
 
 @app.route('/api/train-schedule', methods=['GET'])
-@timeout(REQUEST_TIMEOUT)
 def get_train_schedule():
-    try:
-        # Get parameters from query string
-        train_name = request.args.get('train_name')
-        train_number = request.args.get('train_number')
-        date = request.args.get('date')
+    args = request.args
+    
+    # Validate required fields
+    missing = next((field for field in TRAIN_SCHEDULE_FIELDS if not args.get(field)), None)
+    if missing:
+        return static_error_response(400, MISSING_FIELD_ERRORS[missing])
+    
+    # Get parameters from query string
+    train_name = args.get('train_name')
+    train_number = args.get('train_number')
+    date = args.get('date')
+    
+    if not is_valid_date(date):
+        return static_error_response(400, INVALID_DATE_ERROR)
+    
+    # Get train schedule with delays
+    schedule = cached_run(
+        schedule_cache,
+        (train_number, date),
+        get_pipeline().get_train_schedule,
+        train_name,
+        train_number,
+        date
+    )
+    
+    if not schedule:
+        return error_response(404, 'Failed to get train schedule')
         
-        # Validate required fields
-        required_fields = {
-            'train_name': train_name,
-            'train_number': train_number,
-            'date': date
-        }
-        
-        for field, value in required_fields.items():
-            if not value:
-                return jsonify({
-                    'status': 'error',
-                    'code': 400,
-                    'message': f'Missing required field: {field}',
-                    'request_id': g.request_id
-                }), 400
-        
-        # Get train schedule with delays
-        schedule = pipeline.get_train_schedule(
-            train_name,
-            train_number,
-            date
-        )
-        
-        if not schedule:
-            return jsonify({
-                'status': 'error',
-                'code': 404,
-                'message': 'Failed to get train schedule',
-                'request_id': g.request_id
-            }), 404
-            
-        return jsonify({
-            'status': 'success',
-            'data': schedule,
-            'request_id': g.request_id
-        })
-        
-    except TimeoutError:
-        logger.error(f"Request timed out - ID: {g.request_id}")
-        return jsonify({
-            'status': 'error',
-            'code': 504,
-            'message': 'Request timed out. Please try again.',
-            'request_id': g.request_id
-        }), 504
-    except Exception as e:
-        logger.error(f"Error processing request - ID: {g.request_id}: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'code': 500,
-            'message': str(e),
-            'request_id': g.request_id
-        }), 500
+    return success_response(schedule)
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({
-        'status': 'healthy',
-        'request_id': g.request_id
-    })
+    response = app.response_class(HEALTH_BODY, mimetype='application/json')
+    response.set_etag(HEALTH_ETAG)
+    # Answers 304 Not Modified when the caller already holds this ETag
+    return response.make_conditional(request)
 
 if __name__ == '__main__':
+    # Werkzeug development server for local runs only; production uses gunicorn.conf.py
     port = int(os.environ.get('PORT', 5000))
-    # Set timeout for the server
-    app.config['TIMEOUT'] = REQUEST_TIMEOUT
     app.run(host='0.0.0.0', port=port, threaded=True) 
\ No newline at end of file
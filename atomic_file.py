@@ -0,0 +1,20 @@
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+@contextmanager
+def atomic_path(path):
+    """Yield a private temporary path next to path and move it over path once the block succeeds.
+
+    Readers (other threads or gunicorn workers) see either the old file or the new one, never a
+    half-written file, and a failed write leaves the existing file untouched. The temporary name
+    keeps the suffix, since writers such as XGBoost pick the format from it.
+    """
+    path = Path(path)
+    temp_path = path.with_name(f".{path.stem}.{os.getpid()}-{threading.get_ident()}{path.suffix}")
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        temp_path.unlink(missing_ok=True)
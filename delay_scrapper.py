@@ -1,37 +1,78 @@
 import requests
+from http_client import SESSION
+from atomic_file import atomic_path
 import re
+import csv
 import json
-from bs4 import BeautifulSoup
+import time
+from itertools import repeat
+from pathlib import Path
 
-def download_html(train_name: str, train_number: str):
+# Captures the JavaScript array assigned to et.rsStat.tooltipData, straight from the page bytes
+TOOLTIP_RE = re.compile(rb"et\.rsStat\.tooltipData\s*=\s*(\[[\s\S]+?\]);")
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Connection': 'keep-alive',
+}
+
+# Cleanup patterns that turn the JavaScript array into valid JSON
+JS_DATE_RE = re.compile(r'new Date\((\d+),(\d+),(\d+)\)')
+TRAILING_COMMA_RE = re.compile(r",\s*([\]}])")
+
+# A saved history page is reused instead of refetched while it is younger than this
+HTML_CACHE_SECONDS = 6 * 60 * 60
+
+# Buffer whole delay CSVs in memory so they reach disk in a few large writes
+CSV_BUFFER_SIZE = 1024 * 1024
+
+def js_date_to_iso(match):
+    """Rewrite a new Date(y, m, d) match as a quoted ISO date (JavaScript months are 0-based)."""
+    return f'"{int(match[1])}-{int(match[2]) + 1:02d}-{int(match[3]):02d}"'
+
+def js_array_to_json(js_array: str):
+    """Rewrite the tooltipData JavaScript array as a JSON string."""
+    # Replace new Date() with ISO date string
+    js_array = JS_DATE_RE.sub(js_date_to_iso, js_array)
+    
+    # Replace null with 0
+    js_array = js_array.replace("null", "0")
+    
+    # Remove trailing commas from lists and objects in one pass
+    js_array = TRAILING_COMMA_RE.sub(r"\1", js_array)
+    
+    # Convert single quotes to double quotes
+    return js_array.replace("'", '"')
+
+def download_html(train_name: str, train_number: str, cache_html: bool = False):
     url = f"https://etrain.info/train/{train_name.replace(' ', '-')}-{train_number}/history?d=1y"
+    html_file = Path(f"{train_number}_history.html")
+    
+    # Reuse a recently saved copy of the page rather than downloading it again
+    if cache_html:
+        try:
+            if time.time() - html_file.stat().st_mtime < HTML_CACHE_SECONDS:
+                print(f"Using cached HTML from {html_file}")
+                return html_file.read_bytes()
+        except FileNotFoundError:
+            pass
     
     print(f"Downloading HTML for {train_name} ({train_number})...")
     print(f"URL: {url}")
     
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Connection': 'keep-alive',
-    }
-    
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        response = SESSION.get(url, headers=HEADERS, timeout=30)
         response.raise_for_status()  # Raise an exception for bad status codes
         
-        if response.status_code == 200:
-            # Save the HTML content to a file
-            html_file = f"{train_number}_history.html"
-            with open(html_file, "w", encoding="utf-8") as file:
-                file.write(response.text)
+        # Hand the raw bytes straight to the extractor; only keep them on disk when caching
+        html = response.content
+        if cache_html:
+            html_file.write_bytes(html)
             print(f"HTML file saved as {html_file}")
-            print(f"Response size: {len(response.text)} bytes")
-            return html_file
-        else:
-            print(f"Failed to download the HTML. Status code: {response.status_code}")
-            print(f"Response content: {response.text[:500]}")  # Print first 500 chars of response
-            return None
+        print(f"Response size: {len(html)} bytes")
+        return html
     except requests.exceptions.Timeout:
         print("Request timed out after 30 seconds")
         return None
@@ -42,53 +83,26 @@ def download_html(train_name: str, train_number: str):
         print(f"Unexpected error: {e}")
         return None
 
-def extract_delay_data_from_html(html_file: str, train_number: str):
-    # Load the saved HTML file
-    with open(html_file, "r", encoding="utf-8") as f:
-        html = f.read()
-
-    # Parse HTML using BeautifulSoup
-    soup = BeautifulSoup(html, "html.parser")
-
-    # Find the script tag containing the delay data
-    script_tags = soup.find_all("script")
+def extract_delay_data(html: bytes, train_number: str):
     delay_data = None
     
-    print(f"Searching for delay data in {len(script_tags)} script tags...")
-    
-    for script in script_tags:
-        if script.string and "et.rsStat.tooltipData" in script.string:
-            print("Found script tag with delay data")
-            # Extract the JavaScript array
-            match = re.search(r"et\.rsStat\.tooltipData\s*=\s*(\[[\s\S]+?\]);", script.string)
-            if match:
-                js_array = match.group(1)
-                print("Successfully extracted JavaScript array")
-                
-                # Clean up the JavaScript array to make it valid JSON
-                # Replace new Date() with ISO date string
-                js_array = re.sub(r'new Date\((\d+),(\d+),(\d+)\)', 
-                                lambda m: f'"{int(m[1])}-{int(m[2])+1:02d}-{int(m[3]):02d}"', 
-                                js_array)
-                
-                # Replace null with 0
-                js_array = js_array.replace("null", "0")
-                
-                # Remove trailing commas
-                js_array = re.sub(r",\s*]", "]", js_array)
-                js_array = re.sub(r",\s*}", "}", js_array)
-                
-                # Convert single quotes to double quotes
-                js_array = js_array.replace("'", '"')
-                
-                try:
-                    delay_data = json.loads(js_array)
-                    print(f"Successfully parsed delay data with {len(delay_data)} rows")
-                    break
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing delay data: {e}")
-                    print("Problematic JSON snippet:", js_array[:200])  # Print first 200 chars for debugging
-                    continue
+    # The delay data is a single script assignment, so search the raw page instead of
+    # building a DOM; only the matched array gets decoded
+    print("Searching for delay data in the page...")
+    match = TOOLTIP_RE.search(html)
+    if match:
+        js_array = match.group(1).decode("utf-8")
+        print("Successfully extracted JavaScript array")
+        
+        # Clean up the JavaScript array to make it valid JSON
+        js_array = js_array_to_json(js_array)
+        
+        try:
+            delay_data = json.loads(js_array)
+            print(f"Successfully parsed delay data with {len(delay_data)} rows")
+        except json.JSONDecodeError as e:
+            print(f"Error parsing delay data: {e}")
+            print("Problematic JSON snippet:", js_array[:200])  # Print first 200 chars for debugging
 
     if not delay_data:
         print("No delay data found in HTML")
@@ -99,27 +113,20 @@ def extract_delay_data_from_html(html_file: str, train_number: str):
     station_names = [entry["label"] for entry in delay_data[0][1:]]
     print(f"Found {len(station_names)} stations in delay data")
     
-    # Remaining rows contain daily data
-    records = []
-    for row in delay_data[1:]:
-        date = row[0]
-        for i, delay in enumerate(row[1:]):
-            records.append({
-                "date": date,
-                "station": station_names[i],
-                "delay_minutes": delay
-            })
-
-    print(f"Processed {len(records)} delay records")
-
-    # Save to CSV
-    import csv
+    # Remaining rows contain daily data; stream one CSV row per (date, station) cell
     filename = f"{train_number}.csv"
-    with open(filename, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=["date", "station", "delay_minutes"])
-        writer.writeheader()
-        writer.writerows(records)
-        print(f"\n✅ Delay data saved to {filename}")
+    record_count = 0
+    # Written beside the old CSV and swapped in, so concurrent readers never see a partial file
+    with atomic_path(filename) as temp_file, open(temp_file, "w", newline="", buffering=CSV_BUFFER_SIZE) as f:
+        writer = csv.writer(f)
+        writer.writerow(("date", "station", "delay_minutes"))
+        for row in delay_data[1:]:
+            date = row[0]
+            writer.writerows(zip(repeat(date), station_names, row[1:]))
+            record_count += min(len(row) - 1, len(station_names))
+    
+    print(f"Processed {record_count} delay records")
+    print(f"\n✅ Delay data saved to {filename}")
     
     return True
 
@@ -127,9 +134,9 @@ if __name__ == "__main__":
     train_name = input("Enter train name (e.g., Poorva Express): ").strip()
     train_number = input("Enter train number (e.g., 12303): ").strip()
 
-    # Download the HTML for the train
-    html_file = download_html(train_name, train_number)
+    # Download the HTML for the train, reusing a recent copy from an earlier run
+    html = download_html(train_name, train_number, cache_html=True)
 
-    # If HTML file is downloaded successfully, extract delay data
-    if html_file:
-        extract_delay_data_from_html(html_file, train_number)
\ No newline at end of file
+    # If the page downloaded successfully, extract delay data
+    if html:
+        extract_delay_data(html, train_number)
\ No newline at end of file
@@ -0,0 +1,21 @@
+# Gunicorn settings shared by the Procfile and the Dockerfile
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Keep client connections open between requests
+keepalive = 5
+
+# Pipeline requests may scrape, train and predict for several minutes (REQUEST_TIMEOUT in app.py)
+timeout = 310
+
+# Threaded workers let slow scraping requests overlap inside one process.
+# gevent is not used: model training is CPU-bound C code that would stall its event loop.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Import the app once in the master so workers share its modules copy-on-write.
+# The pipeline itself is built lazily in each worker on first use.
+preload_app = True
@@ -0,0 +1,23 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Retry idempotent GETs on transient gateway failures inside urllib3, with short exponential backoff.
+# Rate limiting (429) is not retried, Retry-After is ignored so a retry never sleeps for long, and
+# read timeouts are not retried so a slow page costs one timeout rather than several.
+# The last response is returned rather than raised so callers' raise_for_status() still reports it.
+RETRY = Retry(
+    total=3,
+    read=False,
+    backoff_factor=0.3,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=('GET',),
+    respect_retry_after_header=False,
+    raise_on_status=False,
+)
+
+# Shared session so scrapers reuse pooled keep-alive connections to etrain.info
+SESSION = requests.Session()
+adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=RETRY)
+SESSION.mount('https://', adapter)
+SESSION.mount('http://', adapter)
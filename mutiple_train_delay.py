@@ -1,9 +1,10 @@
-import requests
-import re
+from http_client import SESSION
 import json
-from bs4 import BeautifulSoup
+from delay_scrapper import CSV_BUFFER_SIZE, TOOLTIP_RE, js_array_to_json
 import csv
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Predefined trains: (train_name, train_number)
 TRAINS = [
@@ -25,41 +26,41 @@ HEADERS = {
                   "Chrome/114.0.0.0 Safari/537.36"
 }
 
+# Request starts keep the original 3 s gap to be polite to the server; the pool
+# only overlaps each download and parse with the wait for the next start
+DOWNLOAD_WORKERS = 5
+REQUEST_SPACING = 3.0  # seconds between request starts
+next_request_at = 0.0
+request_lock = threading.Lock()
+
+def wait_for_turn():
+    """Block until this thread may start its request, reserving the next slot for the one after."""
+    global next_request_at
+    with request_lock:
+        now = time.monotonic()
+        start = max(now, next_request_at)
+        next_request_at = start + REQUEST_SPACING
+    time.sleep(start - now)
+
 def download_html(train_name: str, train_number: str):
     url = f"https://etrain.info/train/{train_name.replace(' ', '-')}-{train_number}/history?d=1y"
     print(f"Downloading HTML for {train_name} ({train_number})...")
-    response = requests.get(url, headers=HEADERS)
+    response = SESSION.get(url, headers=HEADERS)
     if response.status_code == 200:
-        return response.text
+        return response.content
     else:
         print(f"Failed to download {train_name} ({train_number}), status: {response.status_code}")
         return None
 
-def extract_delay_data(html_content: str, train_number: str):
-    soup = BeautifulSoup(html_content, "html.parser")
-    script_tag = soup.find("script", string=lambda s: s and 'et.rsStat.tooltipData' in s)
-    if not script_tag:
-        print(f"⚠️ Could not find delay data for train {train_number}")
-        return []
-
-    script_content = script_tag.string
-    match = re.search(r"et\.rsStat\.tooltipData\s*=\s*(\[[\s\S]+?\]);", script_content)
+def extract_delay_data(html_content: bytes, train_number: str):
+    # Search the raw page for the tooltipData assignment, as delay_scrapper does, instead of parsing the DOM
+    match = TOOLTIP_RE.search(html_content)
     if not match:
-        print(f"⚠️ Could not extract delay array for train {train_number}")
+        print(f"⚠️ Could not find delay data for train {train_number}")
         return []
 
-    js_array = match.group(1)
-
     # Clean JS to JSON
-    js_array = re.sub(
-        r'new Date\((\d+),(\d+),(\d+)\)',
-        lambda m: f'"{int(m[1])}-{int(m[2])+1:02d}-{int(m[3]):02d}"',
-        js_array
-    )
-    js_array = js_array.replace("null", "0")
-    js_array = re.sub(r",\s*]", "]", js_array)
-    js_array = re.sub(r",\s*}", "}", js_array)
-    js_array = js_array.replace("'", '"')
+    js_array = js_array_to_json(match.group(1).decode("utf-8"))
 
     try:
         data = json.loads(js_array)
@@ -70,32 +71,38 @@ def extract_delay_data(html_content: str, train_number: str):
     # First row has station info (skip first element which is date column)
     station_names = [entry["label"] for entry in data[0][1:]]
 
-    records = []
-    for row in data[1:]:
-        date = row[0]
-        for i, delay in enumerate(row[1:]):
-            records.append({
-                "date": date,
-                "station": station_names[i],
-                "delay_minutes": delay,
-                "train_number": train_number
-            })
-    return records
+    return [
+        {
+            "date": row[0],
+            "station": station,
+            "delay_minutes": delay,
+            "train_number": train_number
+        }
+        for row in data[1:]
+        for station, delay in zip(station_names, row[1:])
+    ]
+
+def fetch_delay_records(train):
+    train_name, train_number = train
+    wait_for_turn()
+    # One bad train must not discard the records already fetched for the others
+    try:
+        html = download_html(train_name, train_number)
+        return extract_delay_data(html, train_number) if html else []
+    except Exception as e:
+        print(f"Failed to process {train_name} ({train_number}): {e}")
+        return []
 
 def main():
     all_records = []
-    for train_name, train_number in TRAINS:
-        html = download_html(train_name, train_number)
-        if html:
-            records = extract_delay_data(html, train_number)
-            if records:
-                all_records.extend(records)
-        # To be polite to server
-        time.sleep(3)
+    # map keeps the TRAINS order in the combined CSV
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+        for records in pool.map(fetch_delay_records, TRAINS):
+            all_records.extend(records)
 
     # Save all data into one CSV
     csv_filename = "combined_train_delay_data.csv"
-    with open(csv_filename, "w", newline="", encoding="utf-8") as f:
+    with open(csv_filename, "w", newline="", encoding="utf-8", buffering=CSV_BUFFER_SIZE) as f:
         writer = csv.DictWriter(f, fieldnames=["date", "station", "delay_minutes", "train_number"])
         writer.writeheader()
         writer.writerows(all_records)
@@ -1,12 +1,12 @@
 import pandas as pd
 import numpy as np
 import joblib
+import xgboost as xgb
 import os
 from pathlib import Path
 import logging
-from sklearn.preprocessing import LabelEncoder
 import signal
-from functools import wraps
+from functools import lru_cache, wraps
 import time
 
 # Set up logging
@@ -35,51 +35,84 @@ def timeout(seconds):
         return wrapper
     return decorator
 
+def get_train_files(train_number):
+    """Get the model, encoder and history file paths for a train."""
+    output_dir = Path("pipeline_output")
+    return (
+        output_dir / f"{train_number}_model.ubj",
+        output_dir / f"{train_number}_encoder.pkl",
+        Path(f"{train_number}.csv")
+    )
+
+@lru_cache(maxsize=64)
+def load_train_files(train_number, model_mtime, history_mtime):
+    """Load a train's model, encoder and history, cached until either file is rewritten."""
+    model_file, encoder_file, history_file = get_train_files(train_number)
+    logger.info("Loading model and encoder for train %s", train_number)
+    # The bare booster is enough for inference and predicts in place, without a DMatrix
+    model = xgb.Booster()
+    model.load_model(model_file)
+    # A model trained with early stopping only uses its trees up to best_iteration
+    best_iteration = model.attr("best_iteration")
+    iteration_range = (0, int(best_iteration) + 1) if best_iteration is not None else (0, 0)
+    encoder = joblib.load(encoder_file)
+    
+    logger.info("Loading history data from %s", history_file)
+    history = pd.read_csv(history_file, parse_dates=["date"], date_format="%Y-%m-%d")
+    history_sorted = history.sort_values(["station", "date"])
+    station_medians = history_sorted.groupby("station")["delay_minutes"].median()
+    # (station, date) -> delay, so lag features are index lookups rather than scans and merges
+    delay_lookup = history.drop_duplicates(["station", "date"]).set_index(["station", "date"])["delay_minutes"]
+    return model, iteration_range, encoder, history, history_sorted, station_medians, delay_lookup
+
 def predict_delays(train_number, target_date):
     """Predict delays for a train on a given date."""
-    logger.info(f"Starting prediction for train {train_number} on {target_date}")
+    predictions = predict_delays_batch(train_number, [target_date])
+    return None if predictions is None else predictions[target_date]
+
+def predict_delays_batch(train_number, target_dates):
+    """Predict delays for a train on several dates with a single model call.
+
+    Returns {target_date: {station: delay}}, keyed by the dates as passed in, or None if
+    any step fails so callers never mistake placeholders for predictions.
+    """
+    logger.info("Starting prediction for train %s on %s", train_number, ", ".join(map(str, target_dates)))
     
     # Initialize file paths
-    output_dir = Path("pipeline_output")
-    model_file = output_dir / f"{train_number}_model.pkl"
-    encoder_file = output_dir / f"{train_number}_encoder.pkl"
-    history_file = Path(f"{train_number}.csv")
+    model_file, encoder_file, history_file = get_train_files(train_number)
     
     try:
-        # Load model and encoder
-        logger.info(f"Loading model and encoder for train {train_number}")
-        model = joblib.load(model_file)
-        encoder = joblib.load(encoder_file)
-        
-        # Load and validate history data
-        logger.info(f"Loading history data from {history_file}")
+        # Validate history data, then load everything (or reuse it from an earlier prediction)
         if not history_file.exists():
-            logger.error(f"History file not found: {history_file}")
+            logger.error("History file not found: %s", history_file)
             return None
             
-        history = pd.read_csv(history_file, parse_dates=["date"])
+        model, iteration_range, encoder, history, history_sorted, station_medians, delay_lookup = load_train_files(
+            train_number, model_file.stat().st_mtime_ns, history_file.stat().st_mtime_ns
+        )
         if history.empty:
             logger.error("History data is empty")
             return None
             
-        logger.info(f"Loaded {len(history)} rows from history file")
+        logger.info("Loaded %s rows from history file", len(history))
 
     except FileNotFoundError as e:
-        logger.error(f"Required file not found: {e}")
+        logger.error("Required file not found: %s", e)
         return None
     except Exception as e:
-        logger.error(f"Error loading files: {e}")
+        logger.error("Error loading files: %s", e)
         return None
 
     # Filter stations from history - these define the train's route
     stations = history["station"].unique()
-    target_date = pd.to_datetime(target_date)
+    # Requested dates as given -> parsed dates, without repeats
+    targets = dict(zip(target_dates, pd.to_datetime(list(target_dates))))
+    dates = pd.DatetimeIndex(list(targets.values()))
     
-    logger.info(f"Processing {len(stations)} stations for prediction")
+    logger.info("Processing %s stations on %s dates for prediction", len(stations), len(dates))
 
-    # Prepare base DataFrame for prediction, one row per station for the target date
-    predict_df = pd.DataFrame({"station": stations})
-    predict_df["date"] = target_date
+    # Prepare base DataFrame for prediction, one row per station for each target date
+    predict_df = pd.MultiIndex.from_product([dates, stations], names=["date", "station"]).to_frame(index=False)
 
     try:
         # Add date features same as training
@@ -87,7 +120,7 @@ def predict_delays(train_number, target_date):
         predict_df["day"] = predict_df["date"].dt.day
         predict_df["year"] = predict_df["date"].dt.year
         predict_df["day_of_week"] = predict_df["date"].dt.dayofweek
-        predict_df["is_weekend"] = predict_df["day_of_week"].isin([5,6]).astype(int)
+        predict_df["is_weekend"] = (predict_df["day_of_week"] >= 5).astype(int)
         predict_df["month_sin"] = np.sin(2 * np.pi * predict_df["month"] / 12)
         predict_df["month_cos"] = np.cos(2 * np.pi * predict_df["month"] / 12)
         predict_df["day_sin"] = np.sin(2 * np.pi * predict_df["day"] / 31)
@@ -95,78 +128,63 @@ def predict_delays(train_number, target_date):
 
         # Encode stations with handling for unseen stations
         logger.info("Encoding stations")
-        try:
-            predict_df["station_encoded"] = encoder.transform(predict_df["station"])
-        except ValueError as e:
-            if "unseen labels" in str(e):
-                logger.warning("Found stations not in training data, using fallback encoding")
-                # Create a new encoder for unseen stations
-                new_encoder = LabelEncoder()
-                new_encoder.fit(history["station"])
-                # Transform using the new encoder
-                predict_df["station_encoded"] = new_encoder.transform(predict_df["station"])
-            else:
-                raise
+        # Stations missing from the training categories come back as -1
+        codes = encoder.get_indexer(predict_df["station"])
+        if (codes < 0).any():
+            logger.warning("Found stations not in training data, using fallback encoding")
+            # Encode against every station in the history instead
+            codes = pd.Index(np.sort(history["station"].unique())).get_indexer(predict_df["station"])
+        predict_df["station_encoded"] = codes
     except Exception as e:
-        logger.error(f"Error preparing features: {e}")
-        return {station: "no data found" for station in stations}
+        logger.error("Error preparing features: %s", e)
+        return None
 
-    # To get lag features, merge with history delays for past days for each station
-    history_sorted = history.sort_values(["station", "date"])
+    # To get lag features, look up history delays for past days for each station
     lags = [1, 2, 3]
 
     try:
         # For each lag, get delay from target_date - lag days
         for lag in lags:
-            lag_date = target_date - pd.Timedelta(days=lag)
-            lag_data = history_sorted[history_sorted["date"] == lag_date][["station", "delay_minutes"]]
-            lag_data = lag_data.rename(columns={"delay_minutes": f"prev_delay_{lag}"})
-            predict_df = predict_df.merge(lag_data, on="station", how="left")
+            keys = pd.MultiIndex.from_arrays([predict_df["station"], predict_df["date"] - pd.Timedelta(days=lag)])
+            predict_df[f"prev_delay_{lag}"] = delay_lookup.reindex(keys).to_numpy()
 
         # Fill missing lag delays with median of that station's delays
-        station_medians = history_sorted.groupby("station")["delay_minutes"].median()
+        median_delays = predict_df["station"].map(station_medians).fillna(0)
         for lag in lags:
             col = f"prev_delay_{lag}"
-            predict_df[col] = predict_df.apply(
-                lambda row: station_medians.get(row["station"], 0) 
-                if pd.isna(row[col]) else row[col], 
-                axis=1
-            )
+            predict_df[col] = predict_df[col].fillna(median_delays)
     except Exception as e:
-        logger.error(f"Error calculating lag features: {e}")
-        return {station: "no data found" for station in stations}
+        logger.error("Error calculating lag features: %s", e)
+        return None
 
     # Rolling features: rolling mean (3 days), rolling median (7 days) before target date
-    def get_rolling_feature(station, date, window, agg_func):
-        try:
-            # filter dates before target date
-            s = history_sorted[(history_sorted["station"] == station) & (history_sorted["date"] < date)]
-            if len(s) < window:
-                # Use median of all delays for this station if not enough history
-                return s["delay_minutes"].median() if not s.empty else 0
-            if agg_func == "mean":
-                return s.tail(window)["delay_minutes"].mean()
-            if agg_func == "median":
-                return s.tail(window)["delay_minutes"].median()
-            return 0
-        except Exception as e:
-            logger.error(f"Error calculating rolling feature for station {station}: {e}")
-            return 0
+    def rolling_features(date):
+        # Filter to dates before the target once, then aggregate every station in one grouped pass
+        earlier = history_sorted[history_sorted["date"] < date]
+        earlier_delays = earlier.groupby("station")["delay_minutes"]
+        earlier_counts = earlier_delays.size()
+        # Stations without a full window fall back to the median of all their earlier delays
+        earlier_medians = earlier_delays.median()
+
+        def rolling_feature(window, agg_func):
+            recent = earlier.groupby("station").tail(window).groupby("station")["delay_minutes"].agg(agg_func)
+            return recent.where(earlier_counts >= window, earlier_medians)
+
+        return pd.DataFrame({
+            "rolling_mean_3": rolling_feature(3, "mean"),
+            "rolling_median_7": rolling_feature(7, "median")
+        })
 
     try:
         logger.info("Calculating rolling features")
-        # Calculate rolling features for all stations at once
-        rolling_features = []
-        for st in stations:
-            rm = get_rolling_feature(st, target_date, 3, "mean")
-            rmd = get_rolling_feature(st, target_date, 7, "median")
-            rolling_features.append((rm, rmd))
-        
-        predict_df["rolling_mean_3"] = [x[0] for x in rolling_features]
-        predict_df["rolling_median_7"] = [x[1] for x in rolling_features]
+        rolling = pd.concat({date: rolling_features(date) for date in dates}, names=["date", "station"])
+        keys = pd.MultiIndex.from_frame(predict_df[["date", "station"]])
+        rolling = rolling.reindex(keys).fillna(0)
+        predict_df["rolling_mean_3"] = rolling["rolling_mean_3"].to_numpy()
+        predict_df["rolling_median_7"] = rolling["rolling_median_7"].to_numpy()
     except Exception as e:
-        logger.error(f"Error calculating rolling features: {e}")
-        return {station: "no data found" for station in stations}
+        logger.error("Error calculating rolling features: %s", e)
+        return None
 
     # Prepare feature list same as training
     features = [
@@ -176,24 +194,28 @@ def predict_delays(train_number, target_date):
         "rolling_mean_3", "rolling_median_7"
     ]
 
-    X_pred = predict_df[features]
+    # One contiguous float32 block, the dtype the model was trained on and bins with
+    X_pred = np.ascontiguousarray(predict_df[features].to_numpy(dtype=np.float32))
 
     try:
-        # Predict delays
+        # Predict delays for every station and date in one call
         logger.info("Making predictions")
-        predicted = model.predict(X_pred)
+        predicted = model.inplace_predict(X_pred, iteration_range=iteration_range)
         predicted = np.round(predicted, 2)
-        predict_df["predicted_delay"] = predicted
     except Exception as e:
-        logger.error(f"Error predicting delays: {e}")
-        return {station: "no data found" for station in stations}
+        logger.error("Error predicting delays: %s", e)
+        return None
 
-    # Convert to dictionary of station -> delay
-    delays = dict(zip(predict_df["station"], predict_df["predicted_delay"]))
+    # Rows are grouped by date, so each row of the reshaped array is one date's station -> delay
+    predictions = {
+        date: dict(zip(stations, date_delays))
+        for date, date_delays in zip(targets, predicted.reshape(len(dates), len(stations)))
+    }
     
-    # Log predictions
-    logger.info("\nPredicted delays:")
-    for station, delay in delays.items():
-        logger.info(f"{station}: {delay:.2f} minutes")
+    # Log predictions, one record per date rather than one per station
+    if logger.isEnabledFor(logging.INFO):
+        for date, delays in predictions.items():
+            logger.info("\nPredicted delays for %s:\n%s", date,
+                        "\n".join(f"{station}: {delay:.2f} minutes" for station, delay in delays.items()))
     
-    return delays
\ No newline at end of file
+    return predictions
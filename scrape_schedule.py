@@ -1,8 +1,23 @@
 import requests
+from http_client import SESSION
 from bs4 import BeautifulSoup
-import json
+import orjson
 import re
 
+# Browser-like request headers, built once for every fetch
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+}
+
+# Matches the "(Day N)" suffix on arrival/departure times
+DAY_RE = re.compile(r'\(Day (\d+)\)')
+
+def cell_with_class(cells, css_class):
+    """Return the first cell carrying css_class, like row.find('td', class_=css_class)."""
+    return next((cell for cell in cells if css_class in cell.get('class', ())), None)
+
 def get_station_info(station_cell):
     """Extract station information from a table cell."""
     station_name = station_cell.find('div', class_='fixwelps').text.strip()
@@ -29,12 +44,12 @@ def get_timing_info(timing_cell):
     departure = timing_divs[1].text.strip()
     
     # Extract day information if present
-    arrival_day = re.search(r'\(Day (\d+)\)', arrival)
-    departure_day = re.search(r'\(Day (\d+)\)', departure)
+    arrival_day = DAY_RE.search(arrival)
+    departure_day = DAY_RE.search(departure)
     
     # Clean up the timing strings
-    arrival = re.sub(r'\(Day \d+\)', '', arrival).strip()
-    departure = re.sub(r'\(Day \d+\)', '', departure).strip()
+    arrival = DAY_RE.sub('', arrival).strip()
+    departure = DAY_RE.sub('', departure).strip()
     
     return {
         'arrival': arrival,
@@ -54,46 +69,46 @@ def get_train_info(soup):
         train_info['name'] = train_text.split('(')[0].strip()
         train_info['number'] = train_text.split('(')[1].split(')')[0].strip()
     
+    # Index the bold labels once instead of rescanning the page for each field
+    labels = {}
+    for label in soup.find_all('b'):
+        if label.string:
+            labels.setdefault(label.string, label)
+    
     # Get running days
-    running_days = soup.find('b', string='Running Days:')
+    running_days = labels.get('Running Days:')
     if running_days:
         train_info['running_days'] = running_days.next_sibling.strip()
     
     # Get train type and zone
-    type_info = soup.find('b', string='Type:')
+    type_info = labels.get('Type:')
     if type_info:
         train_info['type'] = type_info.next_sibling.strip()
     
-    zone_info = soup.find('b', string='Zone:')
+    zone_info = labels.get('Zone:')
     if zone_info:
         train_info['zone'] = zone_info.next_sibling.strip()
     
     # Get available classes
-    classes_info = soup.find('b', string='Available Classes:')
+    classes_info = labels.get('Available Classes:')
     if classes_info:
         train_info['available_classes'] = classes_info.next_sibling.strip()
     
     # Check if pantry is available
-    train_info['has_pantry'] = bool(soup.find('b', string='Pantry Available'))
+    train_info['has_pantry'] = 'Pantry Available' in labels
     
     return train_info
 
 def scrape_train_schedule(url):
     """Scrape train schedule from the given URL."""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-    }
-    
     try:
-        response = requests.get(url, headers=headers)
+        response = SESSION.get(url, headers=HEADERS)
         response.raise_for_status()
     except requests.RequestException as e:
         print(f"Error fetching URL: {e}")
         return None
     
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = BeautifulSoup(response.text, 'lxml')
     
     # Get train information
     train_info = get_train_info(soup)
@@ -109,17 +124,20 @@ def scrape_train_schedule(url):
     
     schedule = []
     for row in station_rows:
+        # Collect the row's cells in one scan and pick them out by class
+        cells = row.find_all('td')
+        
         # Get station number and code
-        num_cell = row.find('td', class_='txt-center')
+        num_cell = cell_with_class(cells, 'txt-center')
         station_num = num_cell.find('div', class_='pdl5').text.strip()
         station_code = num_cell.find('small').find('div', class_='pdl5').text.strip()
         
         # Get station details
-        station_cell = row.find('td', class_='intstnCont')
+        station_cell = cell_with_class(cells, 'intstnCont')
         station_info = get_station_info(station_cell)
         
         # Get timing information
-        timing_cell = row.find_all('td')[-1]  # Last cell contains timing info
+        timing_cell = cells[-1]  # Last cell contains timing info
         timing_info = get_timing_info(timing_cell)
         
         # Combine all information
@@ -139,8 +157,8 @@ def scrape_train_schedule(url):
 
 def save_schedule_to_json(data, output_file):
     """Save schedule data to a JSON file."""
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    with open(output_file, 'wb') as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
     print(f"Schedule saved to {output_file}")
 
 def main():
@@ -153,11 +171,11 @@ def main():
         
         # Print train info and first few stations for verification
         print("\nTrain Information:")
-        print(json.dumps(data['train_info'], indent=2))
+        print(orjson.dumps(data['train_info'], option=orjson.OPT_INDENT_2).decode())
         
         print("\nFirst 3 stations in schedule:")
         for station in data['schedule'][:3]:
-            print(json.dumps(station, indent=2))
+            print(orjson.dumps(station, option=orjson.OPT_INDENT_2).decode())
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,6 +1,6 @@
-import requests
+from http_client import SESSION
 from bs4 import BeautifulSoup
-import json
+import orjson
 import re
 
 # --- HARDCODED INPUTS ---
@@ -10,6 +10,21 @@ dst_name = "Chittaranjan"
 dst_code = "CRJ"
 date = "20250521"  # Format: YYYYMMDD or None
 
+# Browser-like request headers, built once for every fetch
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Connection': 'keep-alive',
+}
+
+# Notice markup: HTML tags are dropped and &quot; becomes a plain quote
+NOTICE_MARKUP_RE = re.compile(r'<[^>]+>|&quot;')
+
+def clean_notice(notice):
+    """Strip tags and decode quotes in a notice tooltip in a single pass."""
+    return NOTICE_MARKUP_RE.sub(lambda m: '"' if m.group() == '&quot;' else '', notice)
+
 def slugify(name, code):
     # Converts "Howrah Jn", "HWH" -> "Howrah-Jn-HWH"
     return f"{name.strip().replace(' ', '-')}-{code.strip().upper()}"
@@ -23,27 +38,26 @@ def build_url(src_name, src_code, dst_name, dst_code, date=None):
         url += f"?date={date}"
     return url
 
+def is_class_column(css_class):
+    """Class filter for the per-class availability cells of a train row."""
+    return css_class and 'wd22' in css_class
+
 def get_available_classes(row):
-    classes = []
     # Check each class column (indices 7-13 in the row)
-    class_columns = row.find_all('td', class_=lambda x: x and 'wd22' in x)
-    for col in class_columns:
-        if 'bgrn' in col.get('class', []):  # Green background indicates available class
-            classes.append(col.get('title', ''))
-    return classes
+    class_columns = row.find_all('td', class_=is_class_column)
+    # Green background indicates available class
+    return [col.get('title', '') for col in class_columns if 'bgrn' in col.get('class', [])]
 
 def get_booking_classes(row):
-    classes = []
     booking_div = row.find('div', class_='flexRow')
-    if booking_div:
-        for link in booking_div.find_all('a', class_='cavlink'):
-            classes.append(link.text.strip())
-    return classes
+    if not booking_div:
+        return []
+    return [link.text.strip() for link in booking_div.find_all('a', class_='cavlink')]
 
 def get_train_info(row):
     try:
         # Parse the data-train attribute which contains train info in JSON format
-        train_data = json.loads(row['data-train'])
+        train_data = orjson.loads(row['data-train'])
         
         # Get additional attributes
         booking_available = row.get('book', '0') == '1'
@@ -56,15 +70,8 @@ def get_train_info(row):
         booking_classes = get_booking_classes(row)
         
         # Get notices/remarks if any
-        notices = []
         notice_icons = row.find_all('i', class_='icon-info-circled')
-        for icon in notice_icons:
-            if 'etitle' in icon.attrs:
-                notice = icon['etitle']
-                # Clean up the notice text
-                notice = re.sub(r'<[^>]+>', '', notice)
-                notice = notice.replace('&quot;', '"')
-                notices.append(notice)
+        notices = [clean_notice(icon['etitle']) for icon in notice_icons if 'etitle' in icon.attrs]
         
         # Get pantry availability
         has_pantry = bool(row.find('i', class_='icon-food'))
@@ -92,7 +99,7 @@ def get_train_info(row):
             'has_pantry': has_pantry,
             'is_limited_run': limited_run
         }
-    except (json.JSONDecodeError, KeyError) as e:
+    except (orjson.JSONDecodeError, KeyError) as e:
         print(f"Error processing row: {e}")
         return None
 
@@ -100,21 +107,13 @@ def scrape_trains_between(src_name, src_code, dst_name, dst_code, date=None, out
     url = build_url(src_name, src_code, dst_name, dst_code, date)
     print(f"Fetching: {url}")
     
-    # Add headers to mimic a browser request
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Connection': 'keep-alive',
-    }
-    
-    response = requests.get(url, headers=headers)
+    response = SESSION.get(url, headers=HEADERS)
     if response.status_code != 200:
         print(f"Failed to fetch page: {response.status_code}")
         return None
 
     # Parse HTML using BeautifulSoup
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = BeautifulSoup(response.text, "lxml")
     
     # Find all train rows
     train_rows = soup.find_all('tr', attrs={'data-train': True})
@@ -132,11 +131,11 @@ def scrape_trains_between(src_name, src_code, dst_name, dst_code, date=None, out
     # Print first 3 trains for debug
     print("\nFirst 3 trains found:")
     for train in trains[:3]:
-        print(json.dumps(train, indent=2))
+        print(orjson.dumps(train, option=orjson.OPT_INDENT_2).decode())
     
     if output_json:
-        with open(output_json, "w", encoding="utf-8") as f:
-            json.dump(trains, f, indent=2, ensure_ascii=False)
+        with open(output_json, "wb") as f:
+            f.write(orjson.dumps(trains, option=orjson.OPT_INDENT_2))
         print(f"\nSaved data to {output_json}")
     
     return trains  # Make sure to return the trains list
@@ -1,16 +1,17 @@
-import json
+import importlib
 import os
-from datetime import datetime
-import numpy as np
+import orjson
 import time
 import logging
 from pathlib import Path
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, lru_cache
+from cachetools import TTLCache
 from scrape_trains import scrape_trains_between
 from scrape_schedule import scrape_train_schedule
-from delay_scrapper import download_html, extract_delay_data_from_html
-from model import train_model
-from predict import predict_delays
+from delay_scrapper import download_html, extract_delay_data
 import pandas as pd
 
 # Set up logging
@@ -20,15 +21,82 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class NumpyEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return super(NumpyEncoder, self).default(obj)
+@cache
+def _get_predictor():
+    """Import predict_delays on first use; the predict module pulls in xgboost and scikit-learn."""
+    return importlib.import_module('predict').predict_delays
+
+@cache
+def _get_trainer():
+    """Import train_model on first use; the model module pulls in xgboost and scikit-learn."""
+    return importlib.import_module('model').train_model
+
+def load_station_codes(station_file):
+    """Load station codes keyed by stnCode, re-parsing only when the file changes."""
+    try:
+        mtime = station_file.stat().st_mtime_ns
+    except FileNotFoundError:
+        logger.error("Station code file not found: %s", station_file)
+        return {}
+    return _parse_station_codes(station_file, mtime)
+
+@lru_cache(maxsize=8)
+def _parse_station_codes(station_file, mtime):
+    """Parse and validate one version (by mtime) of the station code file."""
+    station_codes = {}
+    
+    try:
+        try:
+            station_data = orjson.loads(station_file.read_bytes())
+        except orjson.JSONDecodeError as e:
+            logger.error("Invalid JSON in station code file: %s", e)
+            return station_codes
+            
+        if not isinstance(station_data, dict):
+            logger.error("Station data must be a dictionary")
+            return station_codes
+            
+        stations = station_data.get('stations', [])
+        if not isinstance(stations, list):
+            logger.error("Stations must be a list")
+            return station_codes
+        
+        # Convert to dictionary with stnCode as key
+        for station in stations:
+            if not isinstance(station, dict):
+                logger.warning("Invalid station entry: %s", station)
+                continue
+                
+            stn_code = station.get('stnCode')
+            if not stn_code:
+                logger.warning("Station missing code: %s", station)
+                continue
+                
+            station_codes[stn_code] = station
+        
+        logger.info("Successfully loaded %s station codes", len(station_codes))
+            
+    except Exception as e:
+        logger.error("Failed to load station codes: %s", e)
+        # Don't raise the exception, just log it and continue with empty station codes
+    
+    return station_codes
+
+def delay_lookup(delays):
+    """Build a station -> delay getter that falls back to a case-insensitive key match."""
+    folded = {str(station).casefold(): delay for station, delay in delays.items()}
+    
+    def get_delay(station, default="no data found"):
+        delay = delays.get(station)
+        if delay is None:
+            delay = folded.get(station.casefold(), default)
+        return delay
+    
+    return get_delay
+
+def write_json(path, data):
+    """Write data to path as indented UTF-8 JSON (numpy values included)."""
+    Path(path).write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
 
 class TrainPipeline:
     def __init__(self):
@@ -41,73 +109,63 @@ class TrainPipeline:
         self.output_dir.mkdir(exist_ok=True)
         self.temp_dir.mkdir(exist_ok=True)
         
-        # Load station codes
-        self.station_codes = {}
-        self._load_station_codes()
+        self.station_file = self.output_dir / 'stationcode.json'
         
-        logger.info(f"Initialized pipeline with output_dir: {self.output_dir}")
+        # Trains are independent scrape/train/predict jobs, so process them concurrently
+        self.max_workers = int(os.environ.get('TRAIN_WORKERS', 4))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='train')
+        # Split the cores between the fits that may run at once, so they do not oversubscribe the CPU
+        self.train_threads = max(1, (os.cpu_count() or 1) // self.max_workers)
         
-    def _load_station_codes(self):
-        """Load and validate station codes from JSON file."""
-        station_file = self.output_dir / 'stationcode.json'
+        # Predictions for a (train_number, date) pair are reused until they expire
+        self.prediction_cache = TTLCache(maxsize=2048, ttl=int(os.environ.get('PREDICTION_CACHE_TTL', 3600)))
+        self.cache_lock = threading.Lock()
         
-        try:
-            if not station_file.exists():
-                logger.error(f"Station code file not found: {station_file}")
-                return
-                
-            with open(station_file, 'r', encoding='utf-8') as f:
-                try:
-                    station_data = json.load(f)
-                except json.JSONDecodeError as e:
-                    logger.error(f"Invalid JSON in station code file: {e}")
-                    return
-                
-                if not isinstance(station_data, dict):
-                    logger.error("Station data must be a dictionary")
-                    return
-                    
-                stations = station_data.get('stations', [])
-                if not isinstance(stations, list):
-                    logger.error("Stations must be a list")
-                    return
-                
-                # Convert to dictionary with stnCode as key
-                for station in stations:
-                    if not isinstance(station, dict):
-                        logger.warning(f"Invalid station entry: {station}")
-                        continue
-                        
-                    stn_code = station.get('stnCode')
-                    if not stn_code:
-                        logger.warning(f"Station missing code: {station}")
-                        continue
-                        
-                    self.station_codes[stn_code] = station
-                
-                logger.info(f"Successfully loaded {len(self.station_codes)} station codes")
-                
-        except Exception as e:
-            logger.error(f"Failed to load station codes: {e}")
-            # Don't raise the exception, just log it and continue with empty station codes
+        # Trains whose model, encoder and history CSV are on disk and fresh enough to reuse, mapped
+        # to when their oldest file passes MODEL_TTL; tracked in memory so the hot path skips the
+        # existence checks
+        self.model_ttl = int(os.environ.get('MODEL_TTL', 86400))
+        self.trained_models = TTLCache(maxsize=4096, ttl=self.model_ttl)
+        
+        logger.info("Initialized pipeline with output_dir: %s", self.output_dir)
+        
+    @property
+    def station_codes(self):
+        """Station codes, parsed once per file version and shared between pipelines."""
+        return load_station_codes(self.station_file)
         
     def _get_model_paths(self, train_number):
         """Get model file paths for a specific train."""
         return {
-            'model': self.output_dir / f"{train_number}_model.pkl",
+            'model': self.output_dir / f"{train_number}_model.ubj",
             'encoder': self.output_dir / f"{train_number}_encoder.pkl"
         }
         
-    def _cleanup_files(self, files):
-        """Clean up temporary files."""
-        for file in files:
-            if file and os.path.exists(file):
-                try:
-                    os.remove(file)
-                    logger.debug(f"Cleaned up file: {file}")
-                except Exception as e:
-                    logger.warning(f"Failed to clean up {file}: {e}")
-    
+    def _has_fresh_model(self, train_number, csv_file, model_paths):
+        """Check whether a reusable model and history exist, recording the answer in memory.
+        
+        Files trained by an earlier run or another worker count too, as long as the oldest of
+        them is younger than MODEL_TTL.
+        """
+        now = time.time()
+        with self.cache_lock:
+            expires_at = self.trained_models.get(train_number)
+        if expires_at is not None:
+            if now < expires_at:
+                return True
+            with self.cache_lock:
+                self.trained_models.pop(train_number, None)
+        try:
+            oldest = min(os.stat(path).st_mtime for path in (csv_file, *model_paths.values()))
+        except FileNotFoundError:
+            return False
+        expires_at = oldest + self.model_ttl
+        if now >= expires_at:
+            return False
+        with self.cache_lock:
+            self.trained_models[train_number] = expires_at
+        return True
+        
     def _wait_for_file(self, file_path, timeout=10, check_interval=0.5):
         """Wait for a file to exist with timeout."""
         start_time = time.time()
@@ -122,102 +180,119 @@ class TrainPipeline:
         train_number = train_info['train_number']
         train_name = train_info['train_name']
         
-        logger.info(f"Processing {train_name} ({train_number})...")
+        logger.info("Processing %s (%s)...", train_name, train_number)
+        
+        # Reuse a recent prediction for the same train and date
+        cache_key = (train_number, date)
+        with self.cache_lock:
+            cached_delays = self.prediction_cache.get(cache_key)
+        if cached_delays is not None:
+            logger.info("Using cached predictions for train %s on %s", train_number, date)
+            train_info['predicted_delays'] = dict(cached_delays)
+            return train_info
         
         # Initialize file paths
-        html_file = None
         csv_file = Path(f"{train_number}.csv")
         model_paths = self._get_model_paths(train_number)
         
-        # Check if we already have a model and history
-        if all(path.exists() for path in model_paths.values()) and csv_file.exists():
-            logger.info(f"Using existing model and history for train {train_number}")
+        # Check if we already have a fresh model and history
+        if self._has_fresh_model(train_number, csv_file, model_paths):
+            logger.info("Using existing model and history for train %s", train_number)
             try:
                 # Step 4: Predict delays using existing model
-                logger.info(f"Predicting delays for train {train_number} on {date}...")
-                delays = predict_delays(train_number, date)
+                logger.info("Predicting delays for train %s on %s...", train_number, date)
+                delays = _get_predictor()(train_number, date)
                 if delays:
+                    self._cache_predictions(cache_key, delays)
                     train_info['predicted_delays'] = delays
                     return train_info
             except Exception as e:
-                logger.error(f"Error using existing model for train {train_number}: {e}")
+                logger.error("Error using existing model for train %s: %s", train_number, e)
+            # Fall through and rebuild the model from fresh history
+            with self.cache_lock:
+                self.trained_models.pop(train_number, None)
         
         try:
             # Step 1: Get delay history with timeout
-            logger.info(f"Downloading HTML for {train_name} ({train_number})...")
+            logger.info("Downloading HTML for %s (%s)...", train_name, train_number)
             try:
-                html_file = download_html(train_name, train_number)
-                if not html_file:
-                    logger.error(f"Failed to download HTML for train {train_number}")
+                html = download_html(train_name, train_number)
+                if not html:
+                    logger.error("Failed to download HTML for train %s", train_number)
                     return self._create_empty_response(train_info)
             except TimeoutError:
-                logger.error(f"Timeout while downloading HTML for train {train_number}")
+                logger.error("Timeout while downloading HTML for train %s", train_number)
                 return self._create_empty_response(train_info)
             except Exception as e:
-                logger.error(f"Error downloading HTML for train {train_number}: {e}")
+                logger.error("Error downloading HTML for train %s: %s", train_number, e)
                 return self._create_empty_response(train_info)
                 
             # Step 2: Extract delay data with timeout
-            logger.info(f"Extracting delay data from HTML...")
+            logger.info("Extracting delay data from HTML...")
             try:
-                if not extract_delay_data_from_html(html_file, train_number):
-                    logger.warning(f"No delay data found in HTML for train {train_number}")
+                if not extract_delay_data(html, train_number):
+                    logger.warning("No delay data found in HTML for train %s", train_number)
                     return self._create_empty_response(train_info)
             except TimeoutError:
-                logger.error(f"Timeout while extracting delay data for train {train_number}")
+                logger.error("Timeout while extracting delay data for train %s", train_number)
                 return self._create_empty_response(train_info)
             except Exception as e:
-                logger.error(f"Error extracting delay data for train {train_number}: {e}")
+                logger.error("Error extracting delay data for train %s: %s", train_number, e)
                 return self._create_empty_response(train_info)
             
             # Wait for CSV file to exist
             if not self._wait_for_file(csv_file, timeout=5):  # Reduced timeout
-                logger.error(f"No delay history found for train {train_number}")
+                logger.error("No delay history found for train %s", train_number)
                 return self._create_empty_response(train_info)
             
             # Check if we have enough data
-            df = pd.read_csv(csv_file)
+            df = pd.read_csv(csv_file, usecols=["date"])
             if len(df) < 2:  # Need at least 2 samples for train/test split
-                logger.warning(f"Not enough delay data for train {train_number} (only {len(df)} samples)")
+                logger.warning("Not enough delay data for train %s (only %s samples)", train_number, len(df))
                 return self._create_empty_response(train_info)
             
             # Step 3: Train model
-            logger.info(f"Training model for train {train_number}...")
-            model_result = train_model(train_number)
+            logger.info("Training model for train %s...", train_number)
+            model_result = _get_trainer()(train_number, n_jobs=self.train_threads)
             if not model_result:
-                logger.warning(f"Could not train model for train {train_number} - skipping")
+                logger.warning("Could not train model for train %s - skipping", train_number)
                 return self._create_empty_response(train_info)
             
             # Wait for model files to be saved
             if not all(self._wait_for_file(path, timeout=5) for path in model_paths.values()):  # Reduced timeout
-                logger.error(f"Model files not found for train {train_number}")
+                logger.error("Model files not found for train %s", train_number)
                 return self._create_empty_response(train_info)
             
+            # The fresh history CSV was written just before training
+            with self.cache_lock:
+                self.trained_models[train_number] = time.time() + self.model_ttl
+            
             # Step 4: Predict delays
-            logger.info(f"Predicting delays for train {train_number} on {date}...")
-            delays = predict_delays(train_number, date)
+            logger.info("Predicting delays for train %s on %s...", train_number, date)
+            delays = _get_predictor()(train_number, date)
             if not delays:
-                logger.error(f"Failed to predict delays for train {train_number}")
+                logger.error("Failed to predict delays for train %s", train_number)
                 return self._create_empty_response(train_info)
             
-            # Debug logging for delays
-            logger.info("\nRaw delays from model:")
-            for station, delay in delays.items():
-                logger.info(f"{station}: {delay}")
+            # Debug logging for delays (predict already logs them at INFO), as one record
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("\nRaw delays from model:\n%s",
+                             "\n".join(f"{station}: {delay}" for station, delay in delays.items()))
             
             # Add predicted delays to train info
+            self._cache_predictions(cache_key, delays)
             train_info['predicted_delays'] = delays
             return train_info
             
         except Exception as e:
-            logger.error(f"Error processing train {train_number}: {e}")
+            logger.error("Error processing train %s: %s", train_number, e)
             return self._create_empty_response(train_info)
-        finally:
-            # Clean up temporary files
-            self._cleanup_files([html_file, csv_file])
-            # Don't delete model files until after prediction is done
-            self._cleanup_files(model_paths.values())
     
+    def _cache_predictions(self, cache_key, delays):
+        """Store a copy of successful predictions for later requests."""
+        with self.cache_lock:
+            self.prediction_cache[cache_key] = dict(delays)
+
     def _create_empty_response(self, train_info):
         """Create a response with 'no data found' for all stations."""
         train_info['predicted_delays'] = {station['code']: "no data found" 
@@ -233,12 +308,36 @@ class TrainPipeline:
         if station_code in self.station_codes:
             return self.station_codes[station_code]
             
-        logger.warning(f"Unknown station code: {station_code}")
+        logger.warning("Unknown station code: %s", station_code)
+        return None
+
+    def _process_listed_train(self, train, src_name, src_code, dst_name, dst_code, date):
+        """Predict source and destination delays for one train of a trains-between listing."""
+        try:
+            # Add source and destination info
+            train['stations'] = [
+                {'code': src_code, 'name': src_name, 'is_source': True},
+                {'code': dst_code, 'name': dst_name, 'is_destination': True}
+            ]
+            
+            result = self.process_train(train, date)
+            if result:
+                # Add source and destination delays to train info
+                get_delay = delay_lookup(result.get('predicted_delays', {}))
+                train['source_delay'] = get_delay(src_code)
+                train['destination_delay'] = get_delay(dst_code)
+                return train
+        except Exception as e:
+            logger.error("Error processing train %s: %s", train.get('train_number', 'unknown'), e)
+            # Add train with "no data found" for delays
+            train['source_delay'] = "no data found"
+            train['destination_delay'] = "no data found"
+            return train
         return None
 
     def get_trains_between_stations(self, src_name, src_code, dst_name, dst_code, date):
         """Get all trains between stations with their predicted delays."""
-        logger.info(f"Fetching trains between {src_name} and {dst_name}...")
+        logger.info("Fetching trains between %s and %s...", src_name, dst_name)
         
         # Step 1: Get all trains between stations
         trains = scrape_trains_between(src_name, src_code, dst_name, dst_code, date)
@@ -246,37 +345,19 @@ class TrainPipeline:
             logger.warning("No trains found between stations")
             return None
             
-        # Step 2: Process each train
-        processed_trains = []
-        for train in trains:
-            try:
-                # Add source and destination info
-                train['stations'] = [
-                    {'code': src_code, 'name': src_name, 'is_source': True},
-                    {'code': dst_code, 'name': dst_name, 'is_destination': True}
-                ]
-                
-                result = self.process_train(train, date)
-                if result:
-                    # Add source and destination delays to train info
-                    delays = result.get('predicted_delays', {})
-                    train['source_delay'] = delays.get(src_code, "no data found")
-                    train['destination_delay'] = delays.get(dst_code, "no data found")
-                    processed_trains.append(train)
-            except Exception as e:
-                logger.error(f"Error processing train {train.get('train_number', 'unknown')}: {e}")
-                # Add train with "no data found" for delays
-                train['source_delay'] = "no data found"
-                train['destination_delay'] = "no data found"
-                processed_trains.append(train)
+        # Step 2: Process the trains concurrently, keeping the scraped order
+        futures = [
+            self.executor.submit(self._process_listed_train, train, src_name, src_code, dst_name, dst_code, date)
+            for train in trains
+        ]
+        processed_trains = [train for train in (future.result() for future in futures) if train]
         
         # Step 3: Save results to two different files
         if processed_trains:
             # File 1: All train details with delays
             output_file = self.output_dir / 'trains_between_stations.json'
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(processed_trains, f, indent=2, ensure_ascii=False, cls=NumpyEncoder)
-            logger.info(f"Saved {len(processed_trains)} trains to {output_file}")
+            write_json(output_file, processed_trains)
+            logger.info("Saved %s trains to %s", len(processed_trains), output_file)
             
             # File 2: Simplified version with just essential info and delays
             simplified_trains = []
@@ -298,15 +379,23 @@ class TrainPipeline:
                 simplified_trains.append(simplified)
             
             simplified_file = self.output_dir / 'trains_with_delays.json'
-            with open(simplified_file, 'w', encoding='utf-8') as f:
-                json.dump(simplified_trains, f, indent=2, ensure_ascii=False, cls=NumpyEncoder)
-            logger.info(f"Saved simplified train data with delays to {simplified_file}")
+            write_json(simplified_file, simplified_trains)
+            logger.info("Saved simplified train data with delays to %s", simplified_file)
         
         return processed_trains
     
     def get_train_schedule(self, train_name, train_number, date):
         """Get complete train schedule with predicted delays."""
-        logger.info(f"Fetching schedule for {train_name} ({train_number})...")
+        logger.info("Fetching schedule for %s (%s)...", train_name, train_number)
+        
+        # The delay pipeline only needs the train number and date, so it runs
+        # on the worker pool while the schedule page is scraped. Its train_info
+        # has no stations and is never touched here once submitted.
+        train_info = {
+            'train_number': train_number,
+            'train_name': train_name
+        }
+        prediction = self.executor.submit(self.process_train, train_info, date)
         
         try:
             # Step 1: Get train schedule
@@ -314,7 +403,8 @@ class TrainPipeline:
             schedule_data = scrape_train_schedule(url)
             
             if not schedule_data:
-                logger.error(f"Failed to get schedule for train {train_number}")
+                logger.error("Failed to get schedule for train %s", train_number)
+                prediction.cancel()
                 return None
                 
             # Set source and destination flags in schedule
@@ -322,25 +412,8 @@ class TrainPipeline:
                 schedule_data['schedule'][0]['is_source'] = True
                 schedule_data['schedule'][-1]['is_destination'] = True
                 
-            # Step 2: Process train (get history, train model, predict delays)
-            train_info = {
-                'train_number': train_number,
-                'train_name': train_name,
-                'stations': []  # Initialize stations list
-            }
-            
-            # Add all stations from schedule to train_info using their codes
-            for station in schedule_data['schedule']:
-                if 'station_code' in station:  # Use the code directly from schedule
-                    train_info['stations'].append({
-                        'code': station['station_code'],
-                        'name': station['name'],
-                        'is_source': station.get('is_source', False),
-                        'is_destination': station.get('is_destination', False)
-                    })
-                    logger.info(f"Added station to train_info: {station['name']} (code: {station['station_code']})")
-            
-            result = self.process_train(train_info, date)
+            # Step 2: Wait for the delay pipeline (history, model, predictions)
+            result = prediction.result()
             if not result:
                 # If processing fails, set all delays to "no data found"
                 for station in schedule_data['schedule']:
@@ -348,31 +421,30 @@ class TrainPipeline:
                 return schedule_data
                 
             # Step 3: Add predicted delays to schedule
-            delays = result.get('predicted_delays', {})
-            logger.info("\nPredicted delays from model:")
-            for station, delay in delays.items():
-                logger.info(f"{station}: {delay}")
-                
+            # Attach and log each delay in a single pass over the schedule
+            get_delay = delay_lookup(result.get('predicted_delays', {}))
+            matched = 0
             for station in schedule_data['schedule']:
                 if 'station_code' in station:
                     # Get delay using station code directly from schedule
-                    delay = delays.get(station['station_code'], "no data found")
+                    delay = get_delay(station['station_code'])
                     station['predicted_delay'] = delay
-                    logger.info(f"Added delay for {station['name']} (code: {station['station_code']}): {delay}")
+                    matched += delay != "no data found"
+                    logger.info("Added delay for %s (code: %s): %s", station['name'], station['station_code'], delay)
                 else:
-                    logger.warning(f"No station code found for {station['name']}")
+                    logger.warning("No station code found for %s", station['name'])
                     station['predicted_delay'] = "no data found"
+            logger.info("Predicted delays for %s/%s stations", matched, len(schedule_data['schedule']))
             
             # Step 4: Save results
             output_file = self.output_dir / 'train_schedule_with_delays.json'
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(schedule_data, f, indent=2, ensure_ascii=False, cls=NumpyEncoder)
-            logger.info(f"Saved schedule with delays to {output_file}")
+            write_json(output_file, schedule_data)
+            logger.info("Saved schedule with delays to %s", output_file)
             
             return schedule_data
             
         except Exception as e:
-            logger.error(f"Error getting train schedule: {e}")
+            logger.error("Error getting train schedule: %s", e)
             # Return schedule with "no data found" for all stations
             if schedule_data and 'schedule' in schedule_data:
                 for station in schedule_data['schedule']:
@@ -397,9 +469,9 @@ def main():
     if trains_data:
         logger.info("\nSample of trains found:")
         for train in trains_data[:3]:
-            logger.info(f"\nTrain: {train['train_name']} ({train['train_number']})")
-            logger.info(f"Source delay: {train['source_delay']} minutes")
-            logger.info(f"Destination delay: {train['destination_delay']} minutes")
+            logger.info("\nTrain: %s (%s)", train['train_name'], train['train_number'])
+            logger.info("Source delay: %s minutes", train['source_delay'])
+            logger.info("Destination delay: %s minutes", train['destination_delay'])
     
     # Example 2: Get complete schedule with predicted delays
     logger.info("\n=== Getting complete schedule ===")
@@ -411,10 +483,10 @@ def main():
     if schedule_data:
         logger.info("\nSample of schedule with delays:")
         for station in schedule_data['schedule'][:3]:
-            logger.info(f"\nStation: {station['name']}")
-            logger.info(f"Arrival: {station['arrival']}")
-            logger.info(f"Departure: {station['departure']}")
-            logger.info(f"Predicted delay: {station['predicted_delay']} minutes")
+            logger.info("\nStation: %s", station['name'])
+            logger.info("Arrival: %s", station['arrival'])
+            logger.info("Departure: %s", station['departure'])
+            logger.info("Predicted delay: %s minutes", station['predicted_delay'])
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -3,8 +3,8 @@ import threading
 import time
 import logging
 from pathlib import Path
-import json
 import os
+from train_pipeline import write_json
 
 # Set up logging
 logging.basicConfig(
@@ -22,10 +22,17 @@ class TrainQueue:
         self.output_dir.mkdir(exist_ok=True)
         self.lock = threading.Lock()
         self.process_train_func = process_train_func
+        # (train_number, date) pairs queued or being processed, so repeats are not enqueued twice
+        self.inflight = set()
         
     def add_trains(self, trains, src_code, dst_code, date):
-        """Add trains to the processing queue."""
+        """Add trains to the processing queue, skipping ones that are already pending."""
         for train in trains:
+            key = (train['train_number'], date)
+            with self.lock:
+                if key in self.inflight:
+                    continue
+                self.inflight.add(key)
             train['stations'] = [
                 {'code': src_code, 'name': train['source'], 'is_source': True},
                 {'code': dst_code, 'name': train['destination'], 'is_destination': True}
@@ -68,25 +75,30 @@ class TrainQueue:
                     self._save_results()
                 
                 # Mark task as done
-                self.queue.task_done()
+                self._finish(train_number, date)
                 
                 # Small delay to prevent overwhelming the system
                 time.sleep(1)
                 
             except Exception as e:
-                logger.error(f"Error processing train {train.get('train_number', 'unknown')}: {e}")
+                logger.error("Error processing train %s: %s", train.get('train_number', 'unknown'), e)
                 # Mark task as done even if it failed
-                self.queue.task_done()
+                self._finish(train.get('train_number'), date)
         
         self.processing = False
     
+    def _finish(self, train_number, date):
+        """Mark a queued train as done so it can be queued again later."""
+        with self.lock:
+            self.inflight.discard((train_number, date))
+        self.queue.task_done()
+    
     def _save_results(self):
         """Save current results to files."""
         try:
             # Save full results
             output_file = self.output_dir / 'trains_between_stations.json'
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(list(self.results.values()), f, indent=2, ensure_ascii=False)
+            write_json(output_file, list(self.results.values()))
             
             # Save simplified results
             simplified_trains = []
@@ -108,11 +120,10 @@ class TrainQueue:
                 simplified_trains.append(simplified)
             
             simplified_file = self.output_dir / 'trains_with_delays.json'
-            with open(simplified_file, 'w', encoding='utf-8') as f:
-                json.dump(simplified_trains, f, indent=2, ensure_ascii=False)
+            write_json(simplified_file, simplified_trains)
                 
         except Exception as e:
-            logger.error(f"Error saving results: {e}")
+            logger.error("Error saving results: %s", e)
     
     def get_results(self):
         """Get current results."""
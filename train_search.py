@@ -1,8 +1,14 @@
-import requests
-from bs4 import BeautifulSoup
+from http_client import SESSION
+from lxml import html as lxml_html
 import json
 import re
 
+# Digits of the train number inside the listing cell
+TRAIN_NUMBER_RE = re.compile(r'\d+')
+
+# First <table> carrying the "table" class, matched as a whole class token like BeautifulSoup does
+TABLE_XPATH = "(//table[contains(concat(' ', normalize-space(@class), ' '), ' table ')])[1]"
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
                   "AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -18,27 +24,27 @@ def search_trains(source_station: str, dest_station: str, date: str):
     url = f"https://etrain.info/trains/{source_station}-to-{dest_station}?date={date}"
     
     try:
-        response = requests.get(url, headers=HEADERS)
+        response = SESSION.get(url, headers=HEADERS)
         response.raise_for_status()
         
-        soup = BeautifulSoup(response.text, 'html.parser')
+        tree = lxml_html.fromstring(response.text)
         
         # Find the train list table
-        train_table = soup.find('table', {'class': 'table'})
+        train_table = tree.xpath(TABLE_XPATH)
         if not train_table:
             return []
             
         trains = []
-        for row in train_table.find_all('tr')[1:]:  # Skip header row
-            cols = row.find_all('td')
+        for row in train_table[0].xpath('.//tr')[1:]:  # Skip header row
+            cols = row.xpath('.//td')
             if len(cols) >= 4:
-                train_number = cols[0].text.strip()
-                train_name = cols[1].text.strip()
-                departure = cols[2].text.strip()
-                arrival = cols[3].text.strip()
+                train_number = cols[0].text_content().strip()
+                train_name = cols[1].text_content().strip()
+                departure = cols[2].text_content().strip()
+                arrival = cols[3].text_content().strip()
                 
                 # Extract train number from the text
-                train_number_match = re.search(r'\d+', train_number)
+                train_number_match = TRAIN_NUMBER_RE.search(train_number)
                 if train_number_match:
                     train_number = train_number_match.group()
                 
@@ -63,23 +69,23 @@ def get_train_schedule(train_name: str, train_number: str):
     url = f"https://etrain.info/train/{train_name.replace(' ', '-')}-{train_number}/schedule"
     
     try:
-        response = requests.get(url, headers=HEADERS)
+        response = SESSION.get(url, headers=HEADERS)
         response.raise_for_status()
         
-        soup = BeautifulSoup(response.text, 'html.parser')
+        tree = lxml_html.fromstring(response.text)
         
         # Find the schedule table
-        schedule_table = soup.find('table', {'class': 'table'})
+        schedule_table = tree.xpath(TABLE_XPATH)
         if not schedule_table:
             return []
             
         schedule = []
-        for row in schedule_table.find_all('tr')[1:]:  # Skip header row
-            cols = row.find_all('td')
+        for row in schedule_table[0].xpath('.//tr')[1:]:  # Skip header row
+            cols = row.xpath('.//td')
             if len(cols) >= 4:
-                station = cols[1].text.strip()
-                arrival = cols[2].text.strip()
-                departure = cols[3].text.strip()
+                station = cols[1].text_content().strip()
+                arrival = cols[2].text_content().strip()
+                departure = cols[3].text_content().strip()
                 
                 schedule.append({
                     'station': station,